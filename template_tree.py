@@ -1,17 +1,32 @@
-from ansible.errors import AnsibleError, AnsibleParserError
+from ansible.errors import AnsibleError
 from ansible.plugins.action import ActionBase
+from ansible.template import Templar
+from ansible.utils.hashing import checksum, checksum_s
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import PurePath
 
+import copy
+import itertools
 import os
 import os.path as path
 import stat
+import threading
 
-import ansible.module_utils.common.text.converters as converters
+
+# PurePath objects are immutable, so they can safely be shared between tasks.
+@lru_cache(maxsize=4096)
+def _pure_path(value):
+    return PurePath(value)
 
 
 class ActionModule(ActionBase):
     REQUIRED_ARGS = ("src", "dest")
     TEMPLATE_EXTENSION = ".j2"
+    # Upper bound on the combined length of the arguments passed to a single
+    # command. This stays well below the argument size limit of common systems.
+    MAX_COMMAND_LENGTH = 128 * 1024
 
     def run(self, tmp=None, task_vars=None):
         output = super(ActionModule, self).run(tmp, task_vars)
@@ -22,7 +37,10 @@ class ActionModule(ActionBase):
                 output["msg"] = f"missing required argument '{arg}'"
                 return output
 
-        remote_path = self._task.args["dest"]
+        # The remote modules expand "~" in the paths we pass to them, so we do the
+        # same up front. This way, our destination paths take the same form as
+        # the paths returned by the find module.
+        remote_path = self._remote_expand_user(self._task.args["dest"])
 
         local_paths = self._task.args["src"]
         if not isinstance(local_paths, list):
@@ -34,6 +52,12 @@ class ActionModule(ActionBase):
         directory_mode = self._task.args.get("directory_mode", None)
         exclusive = self._task.args.get("exclusive", False)
         exclusive_ignore = self._parse_path_list("exclusive_ignore")
+        parallel = self._parse_positive_int("parallel", 1)
+
+        # Verbose messages are emitted for every entry in the tree, so we check the
+        # verbosity once here, instead of formatting messages that won't be shown.
+        self._vv = self._display.verbosity >= 2
+        self._vvvv = self._display.verbosity >= 4
 
         self._display.vv(f"TEMPLATE_TREE: {local_paths} -> {remote_path}")
 
@@ -46,16 +70,30 @@ class ActionModule(ActionBase):
             )
         )
 
-        self._set_file_contents(to_create, task_vars)
-
         to_delete = list(
             self._get_entries_to_delete(
                 to_create, remote_entries, remote_path, exclusive, exclusive_ignore
             )
         )
 
-        results = list(self._delete_entries(to_delete, task_vars))
-        results.extend(self._create_entries(to_create, task_vars))
+        # Entries whose contents and attributes already match are left alone.
+        # Anything we're about to delete, including the contents of deleted
+        # directories, will be gone by the time we create entries, so it must not
+        # be mistaken for an entry that's already in place.
+        deleted_prefixes = tuple(path.join(e["path"], "") for e in to_delete)
+        remote_index = {
+            e["path"]: e
+            for e in remote_entries
+            if not path.join(e["path"], "").startswith(deleted_prefixes)
+        }
+
+        # Results are consumed as they come in, rather than collecting them first.
+        results = itertools.chain(
+            self._delete_entries(to_delete, task_vars),
+            self._create_entries(
+                to_create, remote_index, remote_path, task_vars, parallel
+            ),
+        )
 
         self._build_output(output, results)
         return output
@@ -68,7 +106,7 @@ class ActionModule(ActionBase):
             is_list = False
 
         try:
-            return list(map(PurePath, paths))
+            return list(map(_pure_path, paths))
         except:
             if is_list:
                 raise AnsibleError(
@@ -77,12 +115,24 @@ class ActionModule(ActionBase):
             else:
                 raise AnsibleError(f"Argument '{argname}' is of an invalid type")
 
+    def _parse_positive_int(self, argname, default):
+        value = self._task.args.get(argname, default)
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise AnsibleError(f"Argument '{argname}' is of an invalid type")
+
+        if value < 1:
+            raise AnsibleError(f"Argument '{argname}' must be at least 1")
+        return value
+
     def _get_local_entries(self, local_paths, task_vars):
         entries = []
         for local_path in local_paths:
             basedir = task_vars.get("role_path", self._loader.get_basedir())
             found_path = self._loader.path_dwim_relative(basedir, "files", local_path)
-            self._display.vv(f"RESOLVE_SRC: '{local_path}' -> '{found_path}'")
+            if self._vv:
+                self._display.vv(f"RESOLVE_SRC: '{local_path}' -> '{found_path}'")
 
             # We'll receive a reference to either a file or a directory.
             # If it's a file, return it directly instead of searching through it.
@@ -101,9 +151,9 @@ class ActionModule(ActionBase):
                     continue
 
             # If the source path does not end with a directory separator, we must
-            # copy the source directory including its contents. filetree does not
-            # support also retrieving the source directory, so we insert our own
-            # entry here.
+            # copy the source directory including its contents. The tree walk does
+            # not return the source directory itself, so we insert our own entry
+            # here.
             # if not local_path.endswith(path.sep):
             entries.append(
                 dict(
@@ -113,23 +163,67 @@ class ActionModule(ActionBase):
                 ),
             )
 
-            filetree_lookup = self._shared_loader_obj.lookup_loader.get(
-                "community.general.filetree", loader=self._loader
+        # The tree walk supports passing multiple paths, and will handle duplicates
+        # for us, by only returning the first entry it finds for a given relative
+        # path. Paths that point to a file are skipped by it.
+        entries += self._walk_local_trees(local_paths, task_vars)
+
+        return entries
+
+    def _walk_local_trees(self, local_paths, task_vars):
+        # This returns the same entries as the community.general.filetree lookup,
+        # limited to the keys we use. Walking the trees ourselves saves us from
+        # loading the lookup, and from the file attributes it collects for every
+        # entry, which we never use.
+        basedir = task_vars.get("role_path", self._loader.get_basedir())
+        seen = set()
+        entries = []
+        for local_path in local_paths:
+            found_dir = self._loader.path_dwim_relative(
+                basedir, "files", path.dirname(local_path)
             )
-            # Filetree supports passing multiple paths, and will handle duplicates
-            # for us, by only returning the first entry it finds for a given
-            # relative path.
-            entries += filetree_lookup.run(local_paths, variables=task_vars)
-
-        # Be explicit about the keys we use.
-        filetree_used_keys = {"root", "path", "state", "src"}
-        entries = [
-            {key: value for key, value in entry.items() if key in filetree_used_keys}
-            for entry in entries
-        ]
+            root = path.join(found_dir, path.basename(local_path))
+
+            for entry in self._scan_local_tree(root, ""):
+                if entry["path"] in seen:
+                    continue
+                seen.add(entry["path"])
+                entries.append(entry)
 
         return entries
 
+    def _scan_local_tree(self, root, relative_dir):
+        try:
+            with os.scandir(path.join(root, relative_dir)) as scanner:
+                dir_entries = list(scanner)
+        except OSError:
+            # Like os.walk, skip anything that isn't a readable directory.
+            return
+
+        subdirs = []
+        for dir_entry in dir_entries:
+            entry = dict(root=root, path=path.join(relative_dir, dir_entry.name))
+            # These checks use the file type reported by scandir, so they don't need
+            # to stat the entry. Symbolic links are never followed.
+            if dir_entry.is_symlink():
+                entry["state"] = "link"
+            elif dir_entry.is_dir(follow_symlinks=False):
+                entry["state"] = "directory"
+                subdirs.append(entry["path"])
+            elif dir_entry.is_file(follow_symlinks=False):
+                entry["state"] = "file"
+                entry["src"] = dir_entry.path
+            else:
+                self._display.warning(
+                    f"Ignoring unsupported local file type: {dir_entry.path}"
+                )
+                continue
+
+            yield entry
+
+        for subdir in subdirs:
+            yield from self._scan_local_tree(root, subdir)
+
     def _get_remote_entries(self, remote_path, task_vars):
         result = self._execute_module(
             module_name="ansible.builtin.find",
@@ -138,6 +232,7 @@ class ActionModule(ActionBase):
                 hidden=True,
                 paths=remote_path,
                 recurse=True,
+                get_checksum=True,
             ),
             task_vars=task_vars,
             tmp=None,
@@ -154,21 +249,18 @@ class ActionModule(ActionBase):
         if "msg" in result and result["msg"]:
             self._display.v(f"find module message: {result['msg']}")
 
-        # Be explicit about the keys we use.
-        filetree_used_keys = {"path", "isdir", "isreg"}
-        entries = [
-            {key: value for key, value in entry.items() if key in filetree_used_keys}
-            for entry in result["files"]
-        ]
+        # Of the keys returned by find, we only use "path", "isdir" and "isreg".
+        # Other keys are left in place, rather than copying every entry.
+        entries = result["files"]
 
         for entry in entries:
             # Since Ansible 9.0, the find module returns its results as
             # AnsibleUnsafeText instead of str. AnsibleUnsafeText is a subclass of str,
             # which is used to prevent accidental templating. As it is a subclass of
-            # str, in most cases, this change is invisible to us. Unfortunately, pathlib
-            # calls the string interner on its arguments, which does not accept a
-            # subclass of str and instead throws an error.
-            # To fix this, we have to convert entry["path"] into an actual str object.
+            # str, in most cases, this change is invisible to us. Unfortunately, some
+            # functions, such as the string interner, do not accept a subclass of str
+            # and instead throw an error.
+            # To prevent this, we convert entry["path"] into an actual str object.
             # This is difficult, because it is already a str subclass and Python
             # optimizes a lot of more obvious attempts away because it sees them as
             # no-ops. The following attempts still return AnsibleUnsafeText objects.
@@ -179,32 +271,32 @@ class ActionModule(ActionBase):
             # * entry["path"][:]
             #
             # We want to avoid depending on some Python optimization behaviour, which
-            # may change between releases. Instead, we make sure that we modify the
-            # string without changing its semantics, which will force the creation of a
-            # new str object. Luckily, pathlib collapses spurious dots in paths, so we
-            # can add /. at the end of the path. Note that adding ./ to the front of a
-            # path may change its semantics when it is an absolute path (i.e. ".//foo"
-            # is interpreted as "foo").
-            entry["path"] = PurePath(f"{entry['path']}/.")
+            # may change between releases. Instead, we call str.__str__ directly,
+            # which bypasses any override in the subclass and always returns an
+            # object of exactly type str. The result is normalised as well, so it
+            # matches our normalised destination paths.
+            entry["path"] = path.normpath(str.__str__(entry["path"]))
 
         return entries
 
     def _get_entries_to_create(
         self, local_entries, remote_path, owner, group, file_mode, directory_mode
     ):
+        remote_root = path.normpath(remote_path)
         for local_entry in local_entries:
-            relative_path = path.normpath(local_entry["path"])
+            # The tree walk already returns normalised relative paths.
+            relative_path = local_entry["path"]
 
-            destination_root = remote_path
+            source_dir = ""
             if not local_entry["root"].endswith(path.sep):
                 source_dir = path.basename(local_entry["root"])
-                destination_root = path.join(destination_root, source_dir)
 
-            destination_path = path.join(destination_root, relative_path)
-            # When processing the root dir, relative_path will be '.', which
-            # will end up as '/.' at the end of destination_path.
+            destination_path = path.join(remote_root, source_dir, relative_path)
+            # When processing the root dir, relative_path will be empty, which
+            # will end up as a trailing '/' at the end of destination_path.
             # Normalising it one more time will get rid of this.
-            destination_path = path.normpath(destination_path)
+            if relative_path in ("", "."):
+                destination_path = path.normpath(destination_path)
 
             entry = {
                 "dest": destination_path,
@@ -222,10 +314,12 @@ class ActionModule(ActionBase):
                     entry["dest"] = destination_path[: -len(self.TEMPLATE_EXTENSION)]
                     entry["template"] = True
 
-                self._display.vv(f"MAP_FILE: '{entry['src']} -> {entry['dest']}'")
+                if self._vv:
+                    self._display.vv(f"MAP_FILE: '{entry['src']} -> {entry['dest']}'")
 
             elif entry["state"] == "directory":
-                self._display.vv(f"REMOTE_DIR: '{entry['dest']}'")
+                if self._vv:
+                    self._display.vv(f"REMOTE_DIR: '{entry['dest']}'")
                 entry["mode"] = directory_mode
             else:
                 self._display.warning(
@@ -235,34 +329,11 @@ class ActionModule(ActionBase):
 
             yield entry
 
-    def _set_file_contents(self, entries, task_vars):
-        for file in filter(lambda e: e["state"] == "file", entries):
-            if file["template"]:
-                self._display.vv(f"TEMPLATE: {file['src']}")
-                content = self._template_local_file_contents(file["src"], task_vars)
-            else:
-                self._display.vv(f"READ: {file['src']}")
-                content = self._get_local_file_contents(file["src"])
-
-            file["content"] = content
-
-    def _template_local_file_contents(self, path, task_vars):
-        self._display.vvvv(f"Template local file '{path}'")
-        template_lookup = self._shared_loader_obj.lookup_loader.get(
-            "ansible.builtin.template",
-            loader=self._loader,
-            templar=self._templar,
-        )
+    def _template_local_file_contents(self, template_lookup, path, task_vars):
+        if self._vvvv:
+            self._display.vvvv(f"Template local file '{path}'")
         return template_lookup.run([path], convert_data=False, variables=task_vars)[0]
 
-    def _get_local_file_contents(self, path):
-        self._display.vvvv(f"File lookup using '{path}' as file")
-        try:
-            contents, _ = self._loader._get_file_contents(path)
-            return converters.to_text(contents, errors="surrogate_or_strict")
-        except AnsibleParserError:
-            raise AnsibleError(f"could not locate file in lookup: {path}")
-
     def _get_entries_to_delete(
         self,
         local_entries,
@@ -280,43 +351,73 @@ class ActionModule(ActionBase):
                 exclusive_ignore,
             )
         )
+        # Appending a separator to both the ignored paths and the relative paths
+        # we compare them against lets a single startswith() call check whether a
+        # path is equal to, or a child of, any of the ignored paths. Ignoring "."
+        # (i.e. the destination itself) ignores everything, so it becomes an empty
+        # prefix, which every path starts with.
+        ignore_prefixes = tuple(
+            "" if str(i) == "." else str(i).rstrip(path.sep) + path.sep
+            for i in exclusive_ignore
+        )
+
+        # Index local entries by their normalised destination path, so we don't
+        # have to scan through all of them for every remote entry.
+        local_index = {path.normpath(entry["dest"]): entry for entry in local_entries}
+
+        # Deleting a directory also deletes everything inside it. By walking the
+        # remote entries shallowest first, we can skip the contents of any
+        # directory we've already decided to delete.
+        deleted_prefixes = ()
+        remote_entries = sorted(remote_entries, key=lambda e: e["path"].count(path.sep))
+
+        # All remote entries live below remote_path, so we can find their relative
+        # paths by cutting off this prefix. Joining with an empty string adds a
+        # trailing separator, unless the path already ends with one (i.e. "/").
+        remote_prefix = path.join(path.normpath(remote_path), "")
 
         for remote_entry in remote_entries:
-            absolute_path: PurePath = remote_entry["path"]
-            relative_path = absolute_path.relative_to(remote_path)
-
-            # We could short-circuit on files here, if their parent is already
-            # being deleted. This will reduce the number of calls
-            # to the file module with state=absent.
-            local_match = next(
-                (
-                    local_entry
-                    for local_entry in local_entries
-                    if PurePath(local_entry["dest"]) == absolute_path
-                ),
-                None,
-            )
+            absolute_path = remote_entry["path"]
+            if not absolute_path.startswith(remote_prefix):
+                # This happens when the find module resolves remote_path differently
+                # than we do, e.g. when it contains environment variables. We can't
+                # safely compare entries in that case.
+                raise AnsibleError(
+                    f"Remote path '{absolute_path}' is not inside destination '{remote_path}'"
+                )
+            relative_path = absolute_path[len(remote_prefix) :]
+
+            if absolute_path.startswith(deleted_prefixes):
+                if self._vv:
+                    self._display.vv(
+                        f"COMPARE: skip '{relative_path}' (parent directory is deleted)"
+                    )
+                continue
+
+            local_match = local_index.get(absolute_path)
 
             if not local_match:
                 if exclusive:
-                    ignore_match = next(
-                        (
-                            ignore_path
-                            for ignore_path in exclusive_ignore
-                            if relative_path.is_relative_to(ignore_path)
-                        ),
-                        None,
-                    )
-                    if ignore_match:
-                        self._display.vv(
-                            f"COMPARE: keep '{relative_path}' (child of ignored path '{ignore_match}')"
-                        )
+                    relative_prefix = relative_path + path.sep
+                    if relative_prefix.startswith(ignore_prefixes):
+                        if self._vv:
+                            ignore_match = next(
+                                p
+                                for p in ignore_prefixes
+                                if relative_prefix.startswith(p)
+                            )
+                            self._display.vv(
+                                f"COMPARE: keep '{relative_path}' (child of ignored path '{ignore_match[:-1] or '.'}')"
+                            )
                     else:
-                        self._display.vv(
-                            f"COMPARE: delete '{relative_path}' (absent in source)"
-                        )
+                        if self._vv:
+                            self._display.vv(
+                                f"COMPARE: delete '{relative_path}' (absent in source)"
+                            )
+                        if remote_entry["isdir"]:
+                            deleted_prefixes += (absolute_path + path.sep,)
                         yield remote_entry
-                else:
+                elif self._vv:
                     self._display.vv(
                         f"COMPARE: keep '{relative_path}' (exclusive mode disabled)"
                     )
@@ -333,63 +434,379 @@ class ActionModule(ActionBase):
                 remote_state = "other"
 
             if local_state != remote_state:
-                self._display.vv(
-                    f"COMPARE: delete '{relative_path}' (source is {remote_state}, destination is {local_state})"
-                )
+                if self._vv:
+                    self._display.vv(
+                        f"COMPARE: delete '{relative_path}' (source is {remote_state}, destination is {local_state})"
+                    )
+                if remote_entry["isdir"]:
+                    deleted_prefixes += (absolute_path + path.sep,)
                 yield remote_entry
                 continue
 
-            self._display.vv(f"COMPARE: keep '{relative_path}' (present in source)")
+            if self._vv:
+                self._display.vv(f"COMPARE: keep '{relative_path}' (present in source)")
 
     def _delete_entries(self, entries, task_vars):
+        # Deleting entries one by one would cost a module round-trip per entry,
+        # so we remove them with as few commands as possible instead. Deepest
+        # entries go first, so nothing is left behind in a directory that is
+        # removed.
+        entries = sorted(entries, key=lambda e: e["path"].count(path.sep), reverse=True)
+        if not entries:
+            return
+
+        paths = [entry["path"] for entry in entries]
+        if self._vv:
+            for entry_path in paths:
+                self._display.vv(f"DELETE: {entry_path}")
+
+        self._run_batched(["rm", "-rf", "--"], paths, task_vars)
+
+        # Report results in the same shape as the file module would.
         for entry in entries:
-            self._display.vv(f"DELETE: {entry['path']}")
-            res = self._execute_module(
-                module_name="ansible.builtin.file",
-                module_args=dict(path=str(entry["path"]), state="absent"),
-                task_vars=task_vars,
-                tmp=None,
-            )
+            result = dict(path=entry["path"], state="absent", changed=True)
+            if self._play_context.diff:
+                if entry["isdir"]:
+                    before_state = "directory"
+                elif entry.get("islnk", False):
+                    before_state = "link"
+                else:
+                    before_state = "file"
 
-            if res.get("failed", False):
-                raise AnsibleError(res["msg"])
-            yield res
+                result["diff"] = dict(
+                    before=dict(path=entry["path"], state=before_state),
+                    after=dict(path=entry["path"], state="absent"),
+                )
+            yield result
 
-    def _create_entries(self, entries, task_vars):
-        for entry in entries:
-            if entry["state"] == "file":
-                result = self._copy_file(entry, task_vars)
-            elif entry["state"] == "directory":
-                result = self._create_directory(entry, task_vars)
+    def _run_batched(self, argv_prefix, paths, task_vars):
+        # Runs argv_prefix on all paths, using as few commands as possible without
+        # exceeding the argument size limit of the remote host.
+        # The command module does not run in check mode, so in check mode we only
+        # report what would have been changed.
+        if self._play_context.check_mode:
+            return
+
+        def length(arg):
+            return len(arg.encode("utf-8", "surrogateescape")) + 1
+
+        prefix_length = sum(map(length, argv_prefix))
+        batch = []
+        batch_length = prefix_length
+        for entry_path in paths:
+            if batch and batch_length + length(entry_path) > self.MAX_COMMAND_LENGTH:
+                self._run_command([*argv_prefix, *batch], task_vars)
+                batch = []
+                batch_length = prefix_length
+            batch.append(entry_path)
+            batch_length += length(entry_path)
+
+        if batch:
+            self._run_command([*argv_prefix, *batch], task_vars)
+
+    def _run_command(self, argv, task_vars):
+        res = self._execute_module(
+            module_name="ansible.builtin.command",
+            module_args=dict(argv=argv),
+            task_vars=task_vars,
+            tmp=None,
+        )
 
-            if result.get("failed", False):
-                raise AnsibleError(result["msg"])
-            yield result
+        if res.get("failed", False):
+            raise AnsibleError(res.get("stderr") or res["msg"])
+
+    def _create_entries(self, entries, remote_index, remote_path, task_vars, parallel):
+        # Directories must exist before we can copy any files into them.
+        directories = [e for e in entries if e["state"] == "directory"]
+        files = [e for e in entries if e["state"] == "file"]
+
+        yield from self._create_directories(
+            directories, remote_index, remote_path, task_vars
+        )
+
+        template_lookup = self._shared_loader_obj.lookup_loader.get(
+            "ansible.builtin.template",
+            loader=self._loader,
+            templar=self._templar,
+        )
+        # Templates are only rendered right before they are copied, so we don't
+        # have to keep the contents of the entire tree in memory.
+        copy_args = (
+            self._get_copy_args(file, template_lookup, task_vars) for file in files
+        )
+
+        if parallel == 1:
+            copy_action = self._create_copy_action(self._connection, self._templar)
+            for args in copy_args:
+                remote_file = remote_index.get(args["dest"])
+                yield self._check_result(
+                    self._copy_file(args, remote_file, task_vars, copy_action)
+                )
+            return
+
+        # Once all directories are in place, files can be copied independently of
+        # each other, which lets us overlap the round-trips to the remote host.
+        worker_state = threading.local()
 
-    def _copy_file(self, file, task_vars):
-        task = self._task.copy()
-        task.args = dict(
-            content=file["content"],
+        def copy_file(args):
+            if not hasattr(worker_state, "copy_action"):
+                worker_state.copy_action = self._create_copy_action(
+                    self._clone_connection(), self._clone_templar()
+                )
+            remote_file = remote_index.get(args["dest"])
+            return self._copy_file(
+                args, remote_file, task_vars, worker_state.copy_action
+            )
+
+        # Templates are rendered by the template lookup, which uses our own templar.
+        # Templars are not thread-safe, so we render on this thread, while the
+        # workers' copy actions each use a templar of their own. We render ahead of
+        # the workers by a limited number of files, to keep them busy without
+        # holding too many rendered templates in memory.
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            pending = deque()
+            for args in copy_args:
+                pending.append(executor.submit(copy_file, args))
+                if len(pending) >= 2 * parallel:
+                    yield self._check_result(pending.popleft().result(), pending)
+
+            while pending:
+                yield self._check_result(pending.popleft().result(), pending)
+
+    def _check_result(self, result, pending=()):
+        # Any copies that haven't started yet are cancelled when one fails.
+        if result.get("failed", False):
+            for future in pending:
+                future.cancel()
+            raise AnsibleError(result["msg"])
+        return result
+
+    def _clone_connection(self):
+        # This is a shallow copy, so the workers still share the underlying
+        # transport. We do have to give each of them its own copy of the state that
+        # is changed for every command:
+        # * Actions store the path of their remote temporary directory on the
+        #   shell, so concurrent copies would clean up each other's temporary files.
+        # * The become plugin stores the marker that tells the connection whether
+        #   privilege escalation succeeded, so concurrent commands would overwrite
+        #   each other's marker.
+        connection = copy.copy(self._connection)
+        connection._shell = copy.copy(self._connection._shell)
+        if self._connection.become is not None:
+            connection.set_become_plugin(copy.copy(self._connection.become))
+        return connection
+
+    def _clone_templar(self):
+        # The template lookup temporarily changes the context of our templar while
+        # rendering, so workers need a templar of their own.
+        return Templar(loader=self._loader, variables=self._templar.available_variables)
+
+    def _get_copy_args(self, file, template_lookup, task_vars):
+        args = dict(
             dest=file["dest"],
             group=file["group"],
             owner=file["owner"],
             mode=file["mode"],
         )
 
-        self._display.vv(f"COPY: {file['dest']}")
-        copy_action = self._shared_loader_obj.action_loader.get(
+        if file["template"]:
+            if self._vv:
+                self._display.vv(f"TEMPLATE: {file['src']}")
+            args["content"] = self._template_local_file_contents(
+                template_lookup, file["src"], task_vars
+            )
+        else:
+            # Let the copy action read the file itself. This way, it doesn't have
+            # to be loaded into memory, and binary files are copied as they are.
+            args["src"] = file["src"]
+
+        return args
+
+    def _create_copy_action(self, connection, templar):
+        # Looking up the copy action is relatively expensive, so we reuse a single
+        # instance, along with a single copy of our task, for all files copied over
+        # a connection.
+        return self._shared_loader_obj.action_loader.get(
             "ansible.builtin.copy",
-            task=task,
-            connection=self._connection,
+            task=self._task.copy(),
+            connection=connection,
             play_context=self._play_context,
             loader=self._loader,
-            templar=self._templar,
+            templar=templar,
             shared_loader_obj=self._shared_loader_obj,
         )
+
+    def _copy_file(self, args, remote_file, task_vars, copy_action):
+        if "content" in args:
+            local_checksum = checksum_s(args["content"])
+        else:
+            local_checksum = checksum(args["src"])
+
+        if self._is_up_to_date(args, local_checksum, remote_file):
+            if self._vv:
+                self._display.vv(f"UNCHANGED: {args['dest']}")
+            return dict(
+                changed=False, state="file", dest=args["dest"], checksum=local_checksum
+            )
+
+        if self._vv:
+            self._display.vv(f"COPY: {args['dest']}")
+        # Each copy action has a task of its own, so only its arguments need to be
+        # replaced for every file.
+        copy_action._task.args = args
         return copy_action.run(task_vars=task_vars)
 
+    def _is_up_to_date(self, args, local_checksum, remote_file):
+        if remote_file is None or remote_file.get("checksum") != local_checksum:
+            return False
+
+        # The copy action would also correct the attributes of the file, so we can
+        # only skip it if those are already as requested.
+        return (
+            self._mode_matches(args["mode"], remote_file)
+            and self._owner_matches(args["owner"], remote_file)
+            and self._group_matches(args["group"], remote_file)
+        )
+
+    def _parse_octal_mode(self, mode):
+        # Returns None for symbolic modes, which we can't compare.
+        if isinstance(mode, int):
+            return mode
+        try:
+            return int(mode, 8)
+        except ValueError:
+            return None
+
+    def _mode_matches(self, mode, remote_entry):
+        if mode is None:
+            return True
+
+        octal_mode = self._parse_octal_mode(mode)
+        # Symbolic modes can't be compared, so we treat them as a mismatch.
+        return octal_mode is not None and int(remote_entry["mode"], 8) == octal_mode
+
+    def _owner_matches(self, owner, remote_entry):
+        return owner is None or str(owner) in (
+            remote_entry["pw_name"],
+            str(remote_entry["uid"]),
+        )
+
+    def _group_matches(self, group, remote_entry):
+        return group is None or str(group) in (
+            remote_entry["gr_name"],
+            str(remote_entry["gid"]),
+        )
+
+    def _create_directories(self, directories, remote_index, remote_path, task_vars):
+        # Some directories are left to the file module, which handles them one by
+        # one, but always gets them right:
+        # * The find module doesn't report on remote_path itself, so we can't tell
+        #   whether it's already in the right state.
+        # * Commands don't expand environment variables in their arguments, and
+        #   relative paths would be resolved against their working directory.
+        # * Symbolic modes can't be compared against the remote mode, so we'd have
+        #   to apply them, and report a change, on every run.
+        remote_root = path.normpath(remote_path)
+        directory_mode = directories[0]["mode"] if directories else None
+        symbolic_mode = (
+            directory_mode is not None
+            and self._parse_octal_mode(directory_mode) is None
+        )
+        batched = []
+        for directory in directories:
+            dest = directory["dest"]
+            if dest == remote_root or not path.isabs(dest) or symbolic_mode:
+                yield self._check_result(self._create_directory(directory, task_vars))
+            else:
+                batched.append(directory)
+        directories = batched
+
+        # Creating the other directories one by one would cost a module round-trip
+        # per directory. Instead, we compare them against the remote entries, and
+        # create or correct all of them with a few batched commands.
+        to_create = []
+        to_chmod = []
+        to_chown = []
+        for directory in directories:
+            remote_entry = remote_index.get(directory["dest"])
+            if remote_entry is None or not remote_entry["isdir"]:
+                # mkdir doesn't apply the owner, group or mode for us.
+                to_create.append(directory)
+                if directory["mode"] is not None:
+                    to_chmod.append(directory)
+                if directory["owner"] is not None or directory["group"] is not None:
+                    to_chown.append(directory)
+                continue
+
+            if not self._mode_matches(directory["mode"], remote_entry):
+                to_chmod.append(directory)
+            owner_matches = self._owner_matches(directory["owner"], remote_entry)
+            group_matches = self._group_matches(directory["group"], remote_entry)
+            if not owner_matches or not group_matches:
+                to_chown.append(directory)
+
+        if self._vv:
+            for directory in to_create:
+                self._display.vv(f"DIR: {directory['dest']}")
+
+        # Directories all share the same owner, group and mode, so the same command
+        # applies them to each directory.
+        if to_create:
+            self._run_batched(
+                ["mkdir", "-p", "--"], [d["dest"] for d in to_create], task_vars
+            )
+        if to_chmod:
+            # Numeric modes passed to chmod keep the setuid and setgid bits of
+            # directories, unless they are given with an explicit leading zero.
+            # Without it, a directory with those bits set would never match.
+            mode = "0" + format(self._parse_octal_mode(directory_mode), "04o")
+            self._run_batched(
+                ["chmod", mode, "--"], [d["dest"] for d in to_chmod], task_vars
+            )
+        if to_chown:
+            owner = to_chown[0]["owner"]
+            group = to_chown[0]["group"]
+            spec = "" if owner is None else str(owner)
+            if group is not None:
+                spec += f":{group}"
+            self._run_batched(
+                ["chown", spec, "--"], [d["dest"] for d in to_chown], task_vars
+            )
+
+        # As with deleted entries, we report a file module style result for each
+        # directory, including what changed about it.
+        created = {d["dest"] for d in to_create}
+        chmodded = {d["dest"] for d in to_chmod}
+        chowned = {d["dest"] for d in to_chown}
+        for directory in directories:
+            dest = directory["dest"]
+            result = dict(
+                path=dest,
+                state="directory",
+                changed=dest in created or dest in chmodded or dest in chowned,
+            )
+            if self._play_context.diff and result["changed"]:
+                before = dict(path=dest, state="directory")
+                after = dict(path=dest, state="directory")
+                if dest in created:
+                    before["state"] = "absent"
+                else:
+                    remote_entry = remote_index[dest]
+                    if dest in chmodded:
+                        before["mode"] = remote_entry["mode"]
+                        after["mode"] = directory["mode"]
+                    if dest in chowned:
+                        before["owner"] = remote_entry["pw_name"]
+                        before["group"] = remote_entry["gr_name"]
+                        after["owner"] = directory["owner"]
+                        after["group"] = directory["group"]
+
+                result["diff"] = dict(before=before, after=after)
+            yield result
+
     def _create_directory(self, directory, task_vars):
-        self._display.vv(f"DIR: {directory['dest']}")
+        if self._vv:
+            self._display.vv(f"DIR: {directory['dest']}")
         return self._execute_module(
             module_name="ansible.builtin.file",
             module_args=dict(
@@ -407,16 +824,19 @@ class ActionModule(ActionBase):
         output["deleted_entries"] = []
         output["managed_directories"] = []
         output["managed_files"] = []
+        entries_by_state = {
+            "absent": output["deleted_entries"],
+            "directory": output["managed_directories"],
+            "file": output["managed_files"],
+        }
+        changed = output.get("changed", False)
+
         for result in operation_results:
-            if "state" in result:
-                if result["state"] == "absent":
-                    output["deleted_entries"].append(result)
-                elif result["state"] == "directory":
-                    output["managed_directories"].append(result)
-                elif result["state"] == "file":
-                    output["managed_files"].append(result)
-
-            output["changed"] = output.get("changed", False) or result["changed"]
+            entries = entries_by_state.get(result.get("state"))
+            if entries is not None:
+                entries.append(result)
+
+            changed = changed or result["changed"]
             if "diff" in result:
                 result_diff = result["diff"]
                 output_diff = output.setdefault("diff", [])
@@ -426,3 +846,5 @@ class ActionModule(ActionBase):
                     output_diff += result_diff
                 else:
                     output_diff.append(result_diff)
+
+        output["changed"] = changed